@@ -8,17 +8,18 @@ setup(
     version='2.1.0',
     url='https://github.com/fraenkel-lab/OmicsIntegrator2',
     classifiers=[
-        'Programming Language :: Python :: 3.5',
-        'Programming Language :: Python :: 3.6'],
+        'Programming Language :: Python :: 3.8'],
+    python_requires='>=3.8',
     license='MIT',
     author='zfrenchee',
     author_email='alex@lenail.org',
     description='',
     install_requires=[
         "numpy",
-        "pandas==0.21.0",
-        "networkx==2.0",
+        "pandas>=0.25.3,<1.0",
+        "networkx>=2.0,<3.0",
         "pcst_fast",
+        "joblib>=1.4",
         "python-louvain",
         "goenrich",
         "sklearn"
@@ -2,13 +2,18 @@
 
 # Core python modules
 import sys, os
+import gzip
 
 # Peripheral python modules
 import argparse
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+# python external libraries
+import numpy as np
 
 # import this module
 # from . import Graph, output_networkx_graph_as_graphml_for_cytoscape, output_networkx_graph_as_json_for_cytoscapejs
-from graph import Graph, output_networkx_graph_as_graphml_for_cytoscape, output_networkx_graph_as_json_for_cytoscapejs, output_networkx_graph_as_interactive_html, get_networkx_graph_as_dataframe_of_nodes, get_networkx_graph_as_dataframe_of_edges
+from graph import n_cpus, Graph, output_networkx_graph_as_graphml_for_cytoscape, output_networkx_graph_as_json_for_cytoscapejs, output_networkx_graph_as_interactive_html, get_networkx_graph_as_dataframe_of_nodes, get_networkx_graph_as_dataframe_of_edges
 
 parser = argparse.ArgumentParser(description="""
     Find multiple pathways within an interactome that are altered in a particular condition using
@@ -32,15 +37,17 @@ io_params.add_argument("-p", "--prize", dest='prize_file', type=str, required=Tr
     help='(Required) Path to the text file containing the prizes. Should be a tab delimited file (*with* header) with lines: "nodeName(tab)prize"')
 io_params.add_argument('-o', '--output', dest='output_dir', action=FullPaths, type=directory, required=True,
     help='(Required) Output directory path')
+io_params.add_argument('--emit-json', dest='emit_json', action='store_true', required=False,
+    help='Flag to also output the augmented forest as a cytoscape.js JSON file, for interactive viewers. Off by default, since serializing it is costly for large sweeps. [default: False]')
 
 # Command parameters (specify what the algorithm does):
 pcsf_params = parser.add_argument_group("PCSF Parameters")
 
-pcsf_params.add_argument("-w", dest="w", nargs="*", type=float, required=False, default=6,
+pcsf_params.add_argument("-w", dest="w", nargs="*", type=float, required=False, default=[6],
     help="Omega: the weight of the edges connecting the dummy node to the nodes selected by dummyMode [default: 6]")
-pcsf_params.add_argument("-b", dest="b", nargs="*", type=float, required=False, default=1,
+pcsf_params.add_argument("-b", dest="b", nargs="*", type=float, required=False, default=[1],
     help="Beta: scaling factor of prizes [default: 1]")
-pcsf_params.add_argument("-g", dest="g", nargs="*", type=float, required=False, default=20,
+pcsf_params.add_argument("-g", dest="g", nargs="*", type=float, required=False, default=[20],
     help="Gamma: multiplicative edge penalty from degree of endpoints [default: 20]")
 pcsf_params.add_argument("-noise", dest="noise", type=float, required=False, default=0.1,
     help="Standard Deviation of the gaussian noise added to edges in Noisy Edges Randomizations [default: 0.1]")
@@ -58,38 +65,111 @@ pcsf_params.add_argument("--excludeTerminals", action='store_true', dest='exclud
     help='Flag to exclude terminals when calculating negative prizes. Use if you want terminals to keep exact assigned prize regardless of degree. [default: False]')
 pcsf_params.add_argument("-s", "--seed", dest='seed', type=int, required=False,
     help='An integer seed for the pseudo-random number generators. If you want to reproduce exact results, supply the same seed. [default: None]')
+pcsf_params.add_argument("--search", dest='search', choices=("grid", "random", "sobol"), required=False, default="grid",
+    help='How to choose the combinations of w, b and g to run. "grid"= every combination of the values passed to -w, -b and -g, "random"= --n_samp points drawn uniformly at random, "sobol"= --n_samp points drawn from a Sobol sequence, both within the range spanned by the min and max of the values passed to -w, -b and -g. [default: grid]')
+pcsf_params.add_argument("--n_samp", dest='n_samples', type=int, required=False, default=16,
+    help='The number of combinations of w, b and g to draw when --search is "random" or "sobol". Sobol sequences are only balanced when this is a power of 2. [default: 16]')
+pcsf_params.add_argument("-j", "--jobs", dest='n_jobs', type=int, required=False, default=n_cpus,
+    help='The number of parameter combinations (from the lists passed to -w, -b and -g) to run in parallel. [default: number of available CPUs]')
 
 
 def output_dataframe_to_tsv(dataframe, output_dir, filename):
     """
-    Output the dataframe to a csv.
+    Output the dataframe to a csv. Filenames ending in .gz will be compressed.
     """
 
     path = os.path.join(os.path.abspath(output_dir), filename)
-    dataframe.to_csv(path, sep='\t', header=True, index=False)
+
+    if filename.endswith('.gz'):
+        # gzip's fastest level still shrinks these tables several-fold, for little CPU time
+        with gzip.open(path, 'wt', compresslevel=1) as output_file:
+            dataframe.to_csv(output_file, sep='\t', header=True, index=False)
+    else:
+        dataframe.to_csv(path, sep='\t', header=True, index=False)
+
+
+def sample_parameters(Gs, Bs, Ws, search, n_samples, seed=None):
+    """
+    Draw points from the box spanned by the min and max of each of the parameter lists.
+
+    Arguments:
+        Gs (list): Values of gamma
+        Bs (list): Values of beta
+        Ws (list): Values of omega
+        search (str): "random" for uniformly random points, "sobol" for points from a scrambled Sobol sequence
+        n_samples (int): the number of points to draw
+        seed (int): seed for the random number generator
+
+    Returns:
+        list: list of dicts of parameters, e.g. [{'g':g, 'b':b, 'w':w},...]
+    """
+
+    lower = np.array([min(Gs), min(Bs), min(Ws)])
+    upper = np.array([max(Gs), max(Bs), max(Ws)])
+
+    if search == "sobol":
+        from scipy.stats import qmc
+        unit_points = qmc.Sobol(d=3, scramble=True, seed=seed).random(n_samples)
+    else:
+        unit_points = np.random.default_rng(seed).uniform(size=(n_samples, 3))
+
+    points = lower + unit_points * (upper - lower)
+
+    return [{'g':g,'b':b,'w':w} for (g, b, w) in points.tolist()]
 
 
 def main():
 
     args = parser.parse_args()
 
-    params = {"w":args.w, "b":args.b, "g":args.g, "noise":args.noise, "dummy_mode":args.dummy_mode, "exclude_terminals":args.exclude_terminals, "seed":args.seed,
+    # Sampling within a box of zero width would run the same combination of w, b and g n_samp times
+    if args.search != "grid" and all(min(values) == max(values) for values in (args.g, args.b, args.w)):
+        parser.error('--search %s samples between the min and max of the values passed to -w, -b and -g, so at least one of them needs two different values' % args.search)
+
+    params = {"noise":args.noise, "dummy_mode":args.dummy_mode, "exclude_terminals":args.exclude_terminals, "seed":args.seed,
               "noisy_edges_repetitions": args.noisy_edges_repetitions, "random_terminals_repetitions": args.random_terminals_repetitions}
 
     params = {param: value for param, value in params.items() if value is not None}
 
     graph = Graph(args.edge_file, params)
+    # Parse the prize file once, rather than once per combination of w, b and g
     graph.prepare_prizes(args.prize_file)
 
-    if args.noisy_edges_repetitions + args.random_terminals_repetitions > 0:
-        forest, augmented_forest = graph.randomizations(args.noisy_edges_repetitions, args.random_terminals_repetitions)
+    # Each combination of w, b and g is run independently, in parallel, and its results are written as soon as they arrive
+    n_combinations = len(args.g) * len(args.b) * len(args.w) if args.search == "grid" else args.n_samples
 
+    if args.search == "grid":
+        results = graph.grid_randomizations(args.g, args.b, args.w, args.noisy_edges_repetitions, args.random_terminals_repetitions, n_jobs=args.n_jobs)
     else:
-        vertex_indices, edge_indices = graph.pcsf()
-        forest, augmented_forest = graph.output_forest_as_networkx(vertex_indices, edge_indices)
+        parameter_sets = sample_parameters(args.g, args.b, args.w, args.search, args.n_samples, seed=args.seed)
+        results = graph.sampled_randomizations(parameter_sets, args.noisy_edges_repetitions, args.random_terminals_repetitions, n_jobs=args.n_jobs)
+
+    # Write outputs from a pool of threads, so that writing one combination's files overlaps with receiving and building the next ones
+    n_writers = 4
+    with ThreadPoolExecutor(max_workers=n_writers) as executor:
+        pending_writes = set()
+
+        for paramstring, (forest, augmented_forest) in results:
+
+            # output_forest_as_networkx has already reported that this forest is empty, and there is nothing to write
+            if augmented_forest.number_of_nodes() == 0: continue
+
+            basename = "graph" if n_combinations == 1 else paramstring
+
+            #pending_writes.add(executor.submit(output_networkx_graph_as_graphml_for_cytoscape, augmented_forest, args.output_dir))
+            pending_writes.add(executor.submit(output_networkx_graph_as_interactive_html, augmented_forest, args.output_dir, filename=basename+".html"))
+            if args.emit_json:
+                pending_writes.add(executor.submit(output_networkx_graph_as_json_for_cytoscapejs, augmented_forest, args.output_dir, filename=basename+".json"))
+
+            # If writing falls behind, wait for it, rather than holding ever more forests in the queue
+            if len(pending_writes) > 2 * n_writers: wait(pending_writes, return_when=FIRST_COMPLETED)
+
+            # Raise any exception encountered while writing as soon as it happens, rather than at the end of the sweep
+            finished_writes = {write for write in pending_writes if write.done()}
+            for write in finished_writes: write.result()
+            pending_writes -= finished_writes
 
-    #output_networkx_graph_as_graphml_for_cytoscape(augmented_forest, args.output_dir)
-    output_networkx_graph_as_interactive_html(augmented_forest, args.output_dir)
+    for write in pending_writes: write.result()
 
 if __name__ == '__main__':
     main()
@@ -5,13 +5,12 @@ import sys
 import os
 import multiprocessing
 import logging
-import random
 import numbers
 import math
 
 # Peripheral python modules
 import argparse
-from collections import Counter
+from collections import Counter, defaultdict
 from itertools import product
 from copy import copy
 import json
@@ -22,6 +21,7 @@ import numpy as np
 import pandas as pd
 import networkx as nx
 from networkx.readwrite import json_graph
+from joblib import Parallel, delayed
 import community    # pip install python-louvain
 from sklearn.cluster import SpectralClustering
 import jinja2
@@ -79,11 +79,12 @@ class Graph:
 
         From the interactome_file, populates
         - `graph.interactome_dataframe` (pandas.DataFrame)
-        - `graph.interactome_graph` (networkx.Graph)
+        - `graph.interactome_graph` (networkx.Graph), lazily
         - `graph.nodes` (pandas.Index),
         - `graph.edges` (list of pairs),
         - `graph.costs` and `graph.edge_penalties` (lists, such that the ordering is the same as in graph.edges),
-        - `graph.node_degrees` (list, such that the ordering is the same as in graph.nodes).
+        - `graph.node_degrees` (list, such that the ordering is the same as in graph.nodes),
+        - `graph.node_degrees_dataframe` (pandas.DataFrame, with a "degree" column indexed by node name).
 
         Arguments:
             interactome_file (str or FILE): tab-delimited text file containing edges in interactome and their weights formatted like "ProteinA\tProteinB\tCost"
@@ -93,20 +94,6 @@ class Graph:
         self.interactome_dataframe = pd.read_csv(interactome_file, sep='\t')
         self.interactome_dataframe.columns = ["source","target","cost"] + self.interactome_dataframe.columns[3:].tolist()  # TODO: error handling
 
-        if not skip_checks:
-            # Handle the case of possible duplicate edges.
-            # Do so by creating a string column of both interactors, e.g. "ABCD1EFGR" and remove duplicates
-            # This operation is time consuming, especially if there do exist duplicates. TODO: optimize this code.
-            self.interactome_dataframe['temp'] = self.interactome_dataframe.apply(lambda row: ''.join(sorted([row['source'], row['target']])), axis=1)
-            duplicated_edges = self.interactome_dataframe[self.interactome_dataframe.set_index('temp').index.duplicated()][['source','target']].values.tolist()
-            logger.info("Duplicated edges in the interactome file (we'll keep the max cost):")
-            logger.info(duplicated_edges)
-            if len(duplicated_edges) > 0:
-                self.interactome_dataframe = self.interactome_dataframe.groupby('temp').max().reset_index()[["source","target","cost"]]
-            else: del self.interactome_dataframe['temp']
-
-        self.interactome_graph = nx.from_pandas_edgelist(self.interactome_dataframe, 'source', 'target', edge_attr=self.interactome_dataframe.columns[2:].tolist())
-
         # Convert the interactome dataframe from string interactor IDs to integer interactor IDs.
         # Do so by selecting the source and target columns from the interactome dataframe,
         # then unstacking them, which (unintuitively) stacks them into one column, allowing us to use factorize.
@@ -117,16 +104,48 @@ class Graph:
         # Here we do the inverse operation of "unstack" above, which gives us an interpretable edges datastructure
         self.edges = self.edges.reshape(self.interactome_dataframe[["source","target"]].shape, order='F')
 
+        if not skip_checks:
+            # Handle the case of possible duplicate edges, e.g. "A B" and "B A".
+            # Do so by sorting the integer IDs of the two interactors of each edge, so that duplicated edges become identical rows.
+            edge_keys = pd.DataFrame(np.sort(self.edges, axis=1))
+            duplicated_edges = self.interactome_dataframe[edge_keys.duplicated().values][['source','target']].values.tolist()
+            logger.info("Duplicated edges in the interactome file (we'll keep the max cost):")
+            logger.info(duplicated_edges)
+            if len(duplicated_edges) > 0:
+                # Visit the edges from most to least costly, keep the first of each set of duplicates, and restore the file's order.
+                most_costly_first = np.argsort(-self.interactome_dataframe['cost'].astype(float).values, kind='mergesort')
+                kept = np.sort(most_costly_first[~edge_keys.iloc[most_costly_first].duplicated().values])
+                self.interactome_dataframe = self.interactome_dataframe.iloc[kept].reset_index(drop=True)
+                self.edges = self.edges[kept]
+
+        # The networkx representation of the interactome is only needed to build outputs, so it's built on first use (see `interactome_graph`)
+        self._interactome_graph = None
+
         self.edge_costs = self.interactome_dataframe['cost'].astype(float).values
 
         # Count the number of incident edges into each node.
         # The indices into this datastructure are the same as those in self.nodes which are the IDs in self.edges.
         self.node_degrees = np.bincount(self.edges.flatten())
+        # Every forest output and every random terminals randomization looks nodes up by degree,
+        # so build those lookup structures once per graph rather than once per call.
+        self.node_degrees_dataframe = pd.DataFrame(self.node_degrees, index=self.nodes, columns=['degree']).astype(int)
+        self._nodes_sorted_by_degree = pd.Series(self.node_degrees).sort_values().index
 
         # The rest of the setup work is occasionally repeated, so use another method to complete setup.
         self._reset_hyperparameters(params=params)
 
 
+    @property
+    def interactome_graph(self):
+        """
+        networkx.Graph: the interactome, built from `graph.interactome_dataframe` the first time it is used.
+        """
+        if self._interactome_graph is None:
+            self._interactome_graph = nx.from_pandas_edgelist(self.interactome_dataframe, 'source', 'target', edge_attr=self.interactome_dataframe.columns[2:].tolist())
+
+        return self._interactome_graph
+
+
     def _reset_hyperparameters(self, params={}):
         """
         Set the parameters on Graph and compute parameter-dependent features.
@@ -142,9 +161,11 @@ class Graph:
         # Knockout any proteins from the interactome
         self._knockout(self.params.knockout)
         # Add costs to each edge, proportional to the degrees of the nodes it connects, modulated by parameter g.
+        # This is computed on whole arrays of endpoint degrees at once, rather than edge by edge in python.
         N = len(self.nodes)
-        self.edge_penalties = self.params.g * np.array([self.node_degrees[a] * self.node_degrees[b] /
-                            ((N - self.node_degrees[a] - 1) * (N - self.node_degrees[b] - 1) + self.node_degrees[a] * self.node_degrees[b]) for a, b in self.edges])
+        degree_a = self.node_degrees[self.edges[:,0]]
+        degree_b = self.node_degrees[self.edges[:,1]]
+        self.edge_penalties = self.params.g * (degree_a * degree_b / ((N - degree_a - 1) * (N - degree_b - 1) + degree_a * degree_b))
 
         self.costs = (self.edge_costs + self.edge_penalties)
 
@@ -165,7 +186,7 @@ class Graph:
         """
 
         # Here's we're indexing the penalized nodes by the indices we used for nodes during initialization
-        nodes_to_penalize.index = graph.nodes.get_indexer(nodes_to_penalize['name'].values)
+        nodes_to_penalize.index = self.nodes.get_indexer(nodes_to_penalize['name'].values)
 
         # there will be some nodes in the penalty dataframe which we don't have in our interactome
         logger.info("Members of the penalty dataframe not present in the interactome (we'll need to drop these):")
@@ -184,9 +205,10 @@ class Graph:
         self.additional_costs = np.zeros(self.costs.shape)
 
         # Iterate through the rows of the nodes_to_penalize dataframe
-        for index, name, penalty_coefficient in nodes_to_penalize.itertuples():
-            # For each protein we'd like to penalize, get the indicies of the edges connected to that node
-            edge_indices = self.interactome_dataframe[(self.interactome_dataframe.source == name) | (self.interactome_dataframe.target == name)].index
+        for node_index, name, penalty_coefficient in nodes_to_penalize.itertuples():
+            # For each protein we'd like to penalize, get the indicies of the edges connected to that node.
+            # Compare against the integer node IDs in self.edges rather than the string names in the interactome dataframe.
+            edge_indices = np.nonzero((self.edges == node_index).any(axis=1))[0]
             # And compute an additional cost on those edges.
             self.additional_costs[edge_indices] += self.edge_costs[edge_indices] / (1 - penalty_coefficient)
         # Apply those additional costs by calling _reset_hyperparameters.
@@ -298,12 +320,11 @@ class Graph:
             numpy.array: indices of the selected edges
         """
 
-        all = list(range(len(self.nodes)))
-        others = list(set(all) - set(self.terminals))
-
+        # Only build the list of endpoints the dummy mode asks for: with the default, "terminals",
+        # neither the list of all nodes nor its difference with the terminals is needed.
         if self.params.dummy_mode == 'terminals': endpoints = self.terminals
-        elif self.params.dummy_mode == 'other': endpoints = others
-        elif self.params.dummy_mode == 'all': endpoints = all
+        elif self.params.dummy_mode == 'other': endpoints = list(set(range(len(self.nodes))) - set(self.terminals))
+        elif self.params.dummy_mode == 'all': endpoints = list(range(len(self.nodes)))
         else: sys.exit("Invalid dummy mode")
 
         dummy_edges, dummy_costs, root, dummy_prize = self._add_dummy_node(connected_to=endpoints)
@@ -328,7 +349,7 @@ class Graph:
 
         # Remove the dummy node and dummy edges for convenience
         vertex_indices = vertex_indices[vertex_indices != root]
-        edge_indices = edge_indices[np.in1d(edge_indices, self.interactome_dataframe.index)]
+        edge_indices = edge_indices[edge_indices < len(self.edges)]  # the dummy edges were appended after the interactome's edges
 
         return vertex_indices, edge_indices
 
@@ -352,7 +373,7 @@ class Graph:
         forest.add_nodes_from(list(set(self.nodes[vertex_indices]) - set(forest.nodes())))
 
         # Set node degrees as attributes on nodes in the netowrkx graph
-        nx.set_node_attributes(forest, pd.DataFrame(self.node_degrees, index=self.nodes, columns=['degree']).loc[list(forest.nodes())].astype(int).to_dict(orient='index'))
+        nx.set_node_attributes(forest, self.node_degrees_dataframe.loc[list(forest.nodes())].to_dict(orient='index'))
 
         # Set all othe attributes on graph
         nx.set_node_attributes(forest, self.node_attributes.loc[list(forest.nodes())].dropna(how='all').to_dict(orient='index'))
@@ -361,14 +382,16 @@ class Graph:
         # Create a new graph including all edges between all selected nodes, not just those edges selected by PCSF.
         augmented_forest = nx.compose(self.interactome_graph.subgraph(forest.nodes()), forest)
 
+        # An empty forest has nothing to post-process, so return early
+        if augmented_forest.number_of_nodes() == 0:
+            logger.info("The resulting Forest is empty. Try different parameters.")
+            return forest, augmented_forest
+
         # Post-processing
         betweenness(augmented_forest)
         louvain_clustering(augmented_forest)
         augment_with_subcellular_localization(augmented_forest)
 
-        if len(augmented_forest.nodes()) == 0:
-            logger.info("The resulting Forest is empty. Try different parameters.")
-
         return forest, augmented_forest
 
 
@@ -400,7 +423,7 @@ class Graph:
             numpy.array: edge weights with added gaussian noise
         """
 
-        return np.clip(np.random.normal(self.costs, self.params.noise), 0.0001, None)  # None means don't clip above
+        return np.clip(self._rng.normal(self.costs, self.params.noise), 0.0001, None)  # None means don't clip above
 
 
     def _random_terminals(self):
@@ -412,9 +435,9 @@ class Graph:
             numpy.array: new terminals
         """
 
-        nodes_sorted_by_degree = pd.Series(self.node_degrees).sort_values().index
+        nodes_sorted_by_degree = self._nodes_sorted_by_degree
         terminal_degree_rankings = np.array([nodes_sorted_by_degree.get_loc(terminal) for terminal in self.terminals])
-        new_terminal_degree_rankings = np.clip(np.rint(np.random.normal(terminal_degree_rankings, 10)), 0, len(self.nodes)-1).astype(int)
+        new_terminal_degree_rankings = np.clip(np.rint(self._rng.normal(terminal_degree_rankings, 10)), 0, len(self.nodes)-1).astype(int)
         new_terminals = pd.Series(nodes_sorted_by_degree)[new_terminal_degree_rankings].values
 
         new_prizes = copy(self.prizes)
@@ -471,11 +494,30 @@ class Graph:
             networkx.Graph: augmented_forest
         """
 
-        if self.params.seed: random.seed(self.params.seed); np.random.seed(seed=self.params.seed)
+        return self._randomizations_as_networkx(*self._randomization_indices(noisy_edges_reps, random_terminals_reps))
+
+
+    def _randomization_indices(self, noisy_edges_reps, random_terminals_reps):
+        """
+        Performs randomizations and merges the results, without building any networkx graphs,
+        so that it only needs the array attributes of this graph. Subroutine of `randomizations`.
+
+        Arguments:
+            noisy_edges_reps (int): Number of "Noisy Edges" type randomizations to perform
+            random_terminals_reps (int): Number of "Random Terminals" type randomizations to perform
+
+        Returns:
+            numpy.array or pandas.DataFrame: vertex indices (with their frequencies, if any randomizations were performed)
+            numpy.array or pandas.DataFrame: edge indices (with their frequencies, if any randomizations were performed)
+        """
+
+        # One Generator (PCG64) for all the randomizations of this call, seeded so that results are reproducible,
+        # rather than re-seeding numpy's global (MT19937) state.
+        self._rng = np.random.default_rng(self.params.seed)
 
         # For single PCSF run
         if noisy_edges_reps == random_terminals_reps == 0:
-            return self.output_forest_as_networkx(*self.pcsf())
+            return self.pcsf()
 
         #### NOISY EDGES ####
         if noisy_edges_reps > 0:
@@ -524,7 +566,27 @@ class Graph:
 
         else: sys.exit("Randomizations was called with invalid noisy_edges_reps and random_terminals_reps.")
 
-        ###########
+        return vertex_indices, edge_indices
+
+
+    def _randomizations_as_networkx(self, vertex_indices, edge_indices):
+        """
+        Construct the forest and augmented forest from the results of `_randomization_indices`,
+        setting the frequencies of occurrence of the vertices as node attributes.
+
+        Arguments:
+            vertex_indices (numpy.array or pandas.DataFrame): vertex indices, from `_randomization_indices`
+            edge_indices (numpy.array or pandas.DataFrame): edge indices, from `_randomization_indices`
+
+        Returns:
+            networkx.Graph: forest
+            networkx.Graph: augmented_forest
+        """
+
+        # For single PCSF run, there are no frequencies to set
+        if not isinstance(vertex_indices, pd.DataFrame):
+            return self.output_forest_as_networkx(vertex_indices, edge_indices)
+
         forest, augmented_forest = self.output_forest_as_networkx(vertex_indices.node_index.values, edge_indices.edge_index.values)
 
         # reindex `vertex_indices_df` by name: basically we "dereference" the vertex indices to vertex names
@@ -597,6 +659,93 @@ class Graph:
         return results
 
 
+    def _eval_randomizations(self, params, noisy_edges_reps, random_terminals_reps):
+        """
+        Convenience method which sets parameters (on top of the current ones) and performs randomizations,
+        returning the vertex and edge indices of the result rather than networkx graphs.
+        """
+        self._reset_hyperparameters(params={**vars(self.params), **params})
+        paramstring = 'G_'+str(self.params.g)+'_B_'+str(self.params.b)+'_W_'+str(self.params.w)
+        return (paramstring, self._randomization_indices(noisy_edges_reps, random_terminals_reps))
+
+
+    def _without_interactome(self):
+        """
+        A shallow copy of this graph without the attributes which are only needed to build networkx outputs,
+        i.e. with just the (numpy) arrays which PCSF and randomizations need. Sent to worker processes in place of this graph.
+        """
+        graph = copy(self)
+        for attribute in ["_interactome_graph", "interactome_dataframe", "node_attributes", "node_degrees_dataframe"]:
+            graph.__dict__.pop(attribute, None)
+        return graph
+
+
+    def grid_randomizations(self, Gs, Bs, Ws, noisy_edges_reps, random_terminals_reps, n_jobs=n_cpus):
+        """
+        Macro function which performs randomizations at every point in a parameter grid.
+
+        The points are run by `sampled_randomizations`, in parallel. As there, the prizes must
+        already have been parsed with `prepare_prizes`.
+
+        Arguments:
+            Gs (list): Values of gamma
+            Bs (list): Values of beta
+            Ws (list): Values of omega
+            noisy_edges_reps (int): Number of "Noisy Edges" type randomizations to perform at each point
+            random_terminals_reps (int): Number of "Random Terminals" type randomizations to perform at each point
+            n_jobs (int): Number of worker processes to use
+
+        Returns:
+            generator: tuples of paramstring and (forest, augmented_forest), yielded in the order the points complete
+        """
+
+        parameter_permutations = [{'g':g,'b':b,'w':w} for (g, b, w) in product(Gs, Bs, Ws)]
+
+        return self.sampled_randomizations(parameter_permutations, noisy_edges_reps, random_terminals_reps, n_jobs=n_jobs)
+
+
+    def sampled_randomizations(self, parameter_sets, noisy_edges_reps, random_terminals_reps, n_jobs=n_cpus):
+        """
+        Macro function which performs randomizations at each of an arbitrary list of parameter points,
+        e.g. randomly sampled ones, rather than at every point of a grid.
+
+        Every point is independent of the others, so the PCSF runs for each point are dispatched
+        to separate worker processes with joblib. Workers receive only this graph's arrays, not
+        the interactome graph or dataframe, and joblib memory-maps the large arrays (edges, costs,
+        prizes) to a file which all workers share read-only, rather than sending each worker a copy.
+        The resulting vertex and edge indices are streamed back in the order the points complete (not
+        the order they were given in, so that one slow point doesn't hold back the ones finished after it),
+        and turned into forests here, so only the forests the caller has yet to consume are held in memory.
+
+        The prize file is parsed only once, by `prepare_prizes`, which must be called beforehand:
+        each point only rescales those prizes by its own beta.
+
+        Arguments:
+            parameter_sets (list): list of dicts of parameters, e.g. [{'g':g, 'b':b, 'w':w},...]
+            noisy_edges_reps (int): Number of "Noisy Edges" type randomizations to perform at each point
+            random_terminals_reps (int): Number of "Random Terminals" type randomizations to perform at each point
+            n_jobs (int): Number of worker processes to use, at most one per point. With a single worker, the points are run in this process.
+
+        Returns:
+            generator: tuples of paramstring and (forest, augmented_forest), yielded in the order the points complete
+        """
+
+        if not hasattr(self, "bare_prizes"): sys.exit("Prizes must be prepared with prepare_prizes before running randomizations.")
+
+        parameter_sets = list(parameter_sets)
+        # Starting a pool of worker processes costs far more than a single PCSF run, so never start more workers than there are points,
+        # and don't start any when there would only be one.
+        n_jobs = min(n_jobs if n_jobs > 0 else n_cpus, len(parameter_sets))
+
+        worker_graph = self._without_interactome()
+        if n_jobs <= 1:
+            results = (worker_graph._eval_randomizations(params, noisy_edges_reps, random_terminals_reps) for params in parameter_sets)
+        else:
+            results = Parallel(n_jobs=n_jobs, prefer='processes', max_nbytes='1M', mmap_mode='r', return_as='generator_unordered')(delayed(worker_graph._eval_randomizations)(params, noisy_edges_reps, random_terminals_reps) for params in parameter_sets)
+
+        return ((paramstring, self._randomizations_as_networkx(*indices)) for paramstring, indices in results)
+
+
     def grid_search(self, prize_file, Gs, Bs, Ws):
         """
         Macro function which performs grid search and merges the results.
@@ -781,6 +930,25 @@ def get_networkx_graph_as_dataframe_of_edges(nxgraph):
     return intermediate[['protein1', 'protein2']]
 
 
+# Output directories this process has already created, so that writing many outputs to the same directory
+# (e.g. during a parameter sweep) doesn't repeat the makedirs syscalls.
+_created_output_dirs = set()
+
+def _make_output_dir(output_dir):
+    """
+    Arguments:
+        output_dir (str): a directory, which is created if it doesn't already exist
+    Returns:
+        str: the absolute path of the directory
+    """
+    output_dir = os.path.abspath(output_dir)
+    if output_dir not in _created_output_dirs:
+        os.makedirs(output_dir, exist_ok=True)
+        _created_output_dirs.add(output_dir)
+
+    return output_dir
+
+
 def output_networkx_graph_as_pickle(nxgraph, output_dir, filename="pcsf_results.pickle"):
     """
     Arguments:
@@ -790,8 +958,8 @@ def output_networkx_graph_as_pickle(nxgraph, output_dir, filename="pcsf_results.
     Returns:
         str: filepath to output
     """
-    os.makedirs(os.path.abspath(output_dir), exist_ok=True)
-    path = os.path.join(os.path.abspath(output_dir), filename)
+    output_dir = _make_output_dir(output_dir)
+    path = os.path.join(output_dir, filename)
     nx.write_gpickle(nxgraph, path)
 
     return path
@@ -806,18 +974,29 @@ def output_networkx_graph_as_graphml_for_cytoscape(nxgraph, output_dir, filename
     Returns:
         str: filepath to output
     """
-    os.makedirs(os.path.abspath(output_dir), exist_ok=True)
-    path = os.path.join(os.path.abspath(output_dir), filename)
+    output_dir = _make_output_dir(output_dir)
+    path = os.path.join(output_dir, filename)
     nx.write_graphml(nxgraph, path)
 
     return path
 
 class Encoder(json.JSONEncoder):
     def default(self, obj):
-        if isinstance(obj, np.int64):
-            return str(obj)
+        # Encode numpy scalars as the equivalent JSON values, as orjson does (NaN as null)
+        if isinstance(obj, np.integer):
+            return int(obj)
+        if isinstance(obj, np.floating):
+            return None if np.isnan(obj) else float(obj)
+        if isinstance(obj, np.bool_):
+            return bool(obj)
         return json.JSONEncoder.default(self, obj)
 
+def _nan_to_none(attributes):
+    """
+    json writes float NaNs (which never reach Encoder.default) as a bare NaN, which isn't valid JSON, so replace them with None (null).
+    """
+    return {key: (None if isinstance(value, float) and math.isnan(value) else value) for key, value in attributes.items()}
+
 def output_networkx_graph_as_json_for_cytoscapejs(nxgraph, output_dir, filename="graph_json.json"):
     """
     Arguments:
@@ -826,15 +1005,23 @@ def output_networkx_graph_as_json_for_cytoscapejs(nxgraph, output_dir, filename=
     Returns:
         str: filepath to output
     """
-    from py2cytoscape import util as cy
+    # Build the cytoscape.js document (the same one py2cytoscape's from_networkx makes) directly from the graph
+    njs = {"data": {**nxgraph.graph, "name": filename.replace(".json", "")},
+           "elements": {"nodes": [{"data": {**attributes, "id": str(node), "name": str(node)}} for node, attributes in nxgraph.nodes(data=True)],
+                        "edges": [{"data": {**attributes, "source": str(source), "target": str(target)}} for source, target, attributes in nxgraph.edges(data=True)]}}
 
-    njs = cy.from_networkx(nxgraph)
-    njs["data"]["name"] = filename.replace(".json", "")
+    # orjson is much faster than the json module on large graphs, and serializes numpy scalars natively
+    try:
+        import orjson
+        output = orjson.dumps(njs, option=orjson.OPT_SERIALIZE_NUMPY)
+    except ImportError:
+        njs["elements"] = {kind: [{"data": _nan_to_none(element["data"])} for element in elements] for kind, elements in njs["elements"].items()}
+        output = json.dumps(njs, cls=Encoder, separators=(",", ":")).encode()
 
-    os.makedirs(os.path.abspath(output_dir), exist_ok=True)
-    path = os.path.join(os.path.abspath(output_dir), filename)
-    with open(path,'w') as output_file:
-        output_file.write(json.dumps(njs, cls=Encoder))
+    output_dir = _make_output_dir(output_dir)
+    path = os.path.join(output_dir, filename)
+    with open(path,'wb') as output_file:
+        output_file.write(output)
 
     return path
 
@@ -848,34 +1035,31 @@ def output_networkx_graph_as_interactive_html(nxgraph, output_dir, filename="gra
         str: filepath to output
     """
 
-    try:
-        vizjinja = get_path('OmicsIntegrator', 'viz.jinja')
-    except:
-        # maybe need os.path.realpath(__file__)
-        print('except')
-        vizjinja = os.path.dirname(os.path.realpath(__file__)) + '/viz.jinja'
+    output_dir = _make_output_dir(output_dir)
+    path = os.path.join(output_dir, filename)
+
+    # There's nothing to draw for an empty graph, so don't serialize it or render the template at all
+    if nxgraph.number_of_nodes() == 0: return path
 
     graph_json = json_graph.node_link_data(nxgraph, attrs=dict(source='source_name', target='target_name', name='id', key='key', link='links'))
 
-    def indexOf(node_id): return [i for (i,node) in enumerate(graph_json['nodes']) if node['id'] == node_id][0]
-    graph_json["links"] = [{**link, **{"source":indexOf(link['source_name']), "target":indexOf(link['target_name'])}} for link in graph_json["links"]]
+    # Index the nodes once, rather than scanning the whole node list for both endpoints of every link
+    index_of = {node['id']: i for (i,node) in enumerate(graph_json['nodes'])}
+    graph_json["links"] = [{**link, **{"source":index_of[link['source_name']], "target":index_of[link['target_name']]}} for link in graph_json["links"]]
     graph_json = json.dumps(graph_json, cls=Encoder)
 
     nodes = nxgraph.nodes()
 
-    os.makedirs(os.path.abspath(output_dir), exist_ok=True)
-    path = os.path.join(os.path.abspath(output_dir), filename)
+    # Collect the values of every attribute in a single pass over the nodes, rather than one pass per attribute
+    attribute_values = defaultdict(list)
+    for node, attributes in nxgraph.nodes(data=True):
+        for attribute_key, attribute_value in attributes.items(): attribute_values[attribute_key].append(attribute_value)
 
-    if len(nodes) > 0:
-        numerical_node_attributes = list(set().union(*[[attribute_key for attribute_key,attribute_value in node[1].items() if isinstance(attribute_value, numbers.Number)] for node in nxgraph.node(data=True)]))
-        #print(numerical_node_attributes)
-        non_numerical_node_attributes = list(set().union(*[[attribute_key for attribute_key,attribute_value in node[1].items() if attribute_key not in numerical_node_attributes] for node in nxgraph.node(data=True)]))
-        min_max = lambda l: (min(l),max(l))
-        numerical_node_attributes = {attribute: min_max(nx.get_node_attributes(nxgraph, attribute).values()) for attribute in numerical_node_attributes}
-        #print(numerical_node_attributes)
-        html_output = templateEnv.get_template('viz.jinja').render(graph_json=graph_json, nodes=nodes, numerical_node_attributes=numerical_node_attributes, non_numerical_node_attributes=non_numerical_node_attributes)
-        with open(path,'w') as output_file:
-            output_file.write(html_output)
+    numerical_node_attributes = {attribute: (min(values),max(values)) for attribute, values in attribute_values.items() if any(isinstance(value, numbers.Number) for value in values)}
+    non_numerical_node_attributes = [attribute for attribute in attribute_values if attribute not in numerical_node_attributes]
+    html_output = templateEnv.get_template('viz.jinja').render(graph_json=graph_json, nodes=nodes, numerical_node_attributes=numerical_node_attributes, non_numerical_node_attributes=non_numerical_node_attributes)
+    with open(path,'w') as output_file:
+        output_file.write(html_output)
 
     return path
 
@@ -887,8 +1071,8 @@ def output_networkx_graph_as_edgelist(nxgraph, output_dir, filename="graph_json.
     Returns:
         str: filepath to output
     """
-    os.makedirs(os.path.abspath(output_dir), exist_ok=True)
-    path = os.path.join(os.path.abspath(output_dir), filename)
+    output_dir = _make_output_dir(output_dir)
+    path = os.path.join(output_dir, filename)
     nx.write_edgelist(nxgraph, path, data=False)
 
     return path
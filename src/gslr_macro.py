@@ -69,7 +69,7 @@ def gslr_macro(graph, dataset, sparsity_low=100, sparsity_high=200, num_steps=25
 
         network = graph.interactome_graph.subgraph(graph.nodes[np.nonzero(class_parameter_vector)].tolist())
 
-        nx.set_node_attributes(network, pd.DataFrame(graph.node_degrees, index=graph.nodes, columns=['degree']).loc[list(network.nodes())].astype(int).to_dict(orient='index'))
+        nx.set_node_attributes(network, graph.node_degrees_dataframe.loc[list(network.nodes())].to_dict(orient='index'))
 
         # Post-processing
         betweenness(network)